@@ -21,25 +21,30 @@ interface to the WildFire API on Palo Alto Networks' WildFire Cloud
 and WildFire appliance.
 """
 
-# XXX Using the requests module which uses urllib3 and has support
-# for multipart form-data would make this much simpler/cleaner (main
-# issue is support for Python 2.x and 3.x in one source).  However I
-# decided to not require non-default modules.  That decision may need
-# to be revisited as some parts of this are not clean.
-
+# XXX We do not require non-default modules; however when urllib3 is
+# available it is used for HTTP so requests to the same server reuse a
+# pooled keep-alive connection (and TLS session), which is
+# significantly faster for request sequences.  urllib.request is used
+# as a fallback and creates a new connection per request.
+
+import asyncio
+import copy
+import functools
+import gzip
+import secrets
 import socket
 import sys
 import os
-from io import BytesIO
-import email
-import email.errors
+import time
 import email.utils
 import logging
+import re
+import zlib
 
 from urllib.request import Request, \
     build_opener, HTTPErrorProcessor, HTTPSHandler
 from urllib.error import URLError
-from urllib.parse import urlencode
+from urllib.parse import quote_plus, unquote
 from http.client import responses
 
 import xml.etree.ElementTree as etree
@@ -57,9 +62,50 @@ try:
 except ImportError:
     _have_certifi = False
 
+try:
+    import urllib3
+    _have_urllib3 = True
+except ImportError:
+    _have_urllib3 = False
+
+try:
+    import aiohttp
+    _have_aiohttp = True
+except ImportError:
+    _have_aiohttp = False
+
+_logger = logging.getLogger(__name__)
+
+_DEFAULT_HEADERS = {
+    'User-Agent': 'pan-python/%s' % __version__,
+    'Accept-Encoding': 'gzip, deflate',
+}
+
+# samples and pcaps are compressed binary content which does not
+# benefit from transfer compression, and with identity encoding an
+# attachment can be streamed to a sink without an inflate step
+_ATTACHMENT_HEADERS = {'Accept-Encoding': 'identity'}
+
+# media type before any ';' parameters
+_content_type_regex = re.compile(r'\s*([^;\s]+)')
+# filename parameter in Content-Disposition, quoted or bare
+_filename_regex = re.compile(r'filename=(?:"([^"]+)"|([^;]+))')
+# RFC 5987 extended parameter: charset'language'percent-encoded-value
+_filename_ext_regex = re.compile(r"filename\*=([^';]*)'[^';]*'([^;]+)")
+# apikey query parameter; redacted from logged URLs
+_apikey_regex = re.compile(r'(apikey=)[^&]*')
+
+
+def _redact_url(url):
+    return _apikey_regex.sub(r'\g<1>' + '*' * 6, url)
+
+
 _cloud_server = 'wildfire.paloaltonetworks.com'
 _encoding = 'utf-8'
 _rfc2231_encode = False
+# verdict cache entry cap; the oldest entries are evicted at the cap
+# so the cache is bounded even when distinct hashes never repeat
+_VERDICT_CACHE_SIZE = 128
 _wildfire_responses = {
     418: 'Unsupported File Type',
 }
@@ -91,6 +137,52 @@ class PanWFapiError(Exception):
     pass
 
 
+# pure function of its arguments; the field-name set is tiny and
+# values like the API key repeat on every request
+@functools.lru_cache(maxsize=256)
+def _encode_field_utf8(name, value):
+    return ('%s="%s"' % (name, value)).encode('utf-8')
+
+
+# the query field names (apikey, hash, format, ...) are fixed ASCII
+# literals, so only the values need quoting; this skips urlencode()'s
+# generic mapping traversal
+def _urlencode(query):
+    return '&'.join('%s=%s' % (k, quote_plus(str(v)))
+                    for k, v in query.items())
+
+
+def _decode_content(body, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # raw deflate stream
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+_DEFAULT_SSL_CONTEXT = None
+
+
+# parsing the certifi CA bundle is pure CPU; share one context per
+# process (SSLContext is safe to use across connections) which also
+# allows TLS session resumption across pooled connections
+def _default_ssl_context():
+    global _DEFAULT_SSL_CONTEXT
+
+    if _DEFAULT_SSL_CONTEXT is None:
+        where = certifi.where()
+        _logger.log(DEBUG1, 'certifi %s: %s', certifi.__version__, where)
+        _DEFAULT_SSL_CONTEXT = ssl.create_default_context(
+            purpose=ssl.Purpose.SERVER_AUTH,
+            cafile=where)
+
+    return _DEFAULT_SSL_CONTEXT
+
+
 class PanWFapi:
     def __init__(self,
                  tag=None,
@@ -99,14 +191,17 @@ class PanWFapi:
                  timeout=None,
                  http=False,
                  ssl_context=None,
-                 agent=None):
-        self._log = logging.getLogger(__name__).log
+                 agent=None,
+                 verdict_cache_ttl=None):
+        self._log = _logger.log
         self.tag = tag
         self.hostname = hostname
         self.api_key = None
         self.timeout = timeout
         self.ssl_context = ssl_context
         self.agent = agent
+        self._verdict_cache_ttl = verdict_cache_ttl
+        self._verdict_cache = {}
 
         self._log(DEBUG3, 'Python version: %s', sys.version)
         self._log(DEBUG3, 'xml.etree.ElementTree version: %s', etree.VERSION)
@@ -121,8 +216,17 @@ class PanWFapi:
             except ValueError:
                 raise PanWFapiError('Invalid timeout: %s' % self.timeout)
 
+        if self._verdict_cache_ttl is not None:
+            try:
+                self._verdict_cache_ttl = int(self._verdict_cache_ttl)
+                if not self._verdict_cache_ttl > 0:
+                    raise ValueError
+            except ValueError:
+                raise PanWFapiError('Invalid verdict_cache_ttl: %s' %
+                                    self._verdict_cache_ttl)
+
         if self.ssl_context is None and _have_certifi:
-            self.ssl_context = self._certifi_ssl_context()
+            self.ssl_context = _default_ssl_context()
 
         init_panrc = {}  # .panrc args from constructor
         if hostname is not None:
@@ -150,18 +254,41 @@ class PanWFapi:
         if self.api_key is None:
             raise PanWFapiError('api_key required')
 
+        # apikey form-data part is identical on every multipart
+        # request; encode it once
+        self._apikey_field = _FormDataPart(name='apikey',
+                                           body=self.api_key)
+
         if http:
             self.uri = 'http://%s' % self.hostname
         else:
             self.uri = 'https://%s' % self.hostname
 
+        self._http = None
+        if _have_urllib3:
+            kwargs = {
+                'num_pools': 4,
+                'maxsize': 8,
+            }
+            if self.ssl_context is not None:
+                kwargs['ssl_context'] = self.ssl_context
+            self._http = urllib3.PoolManager(**kwargs)
+            self._log(DEBUG1, 'using urllib3 %s connection pool',
+                      urllib3.__version__)
+
+        self._session = None  # aiohttp.ClientSession for *_async methods
+
+    _STR_KEYS = ('agent', 'api_key', 'hostname', 'ssl_context',
+                 'tag', 'timeout', 'uri')
+
     def __str__(self):
-        x = self.__dict__.copy()
-        for k in x:
-            if k in ['api_key'] and x[k] is not None:
-                x[k] = '*' * 6
-        return '\n'.join((': '.join((k, str(x[k]))))
-                         for k in sorted(x))
+        x = []
+        for k in self._STR_KEYS:
+            v = getattr(self, k, None)
+            if k == 'api_key' and v is not None:
+                v = '*' * 6
+            x.append('%s: %s' % (k, v))
+        return '\n'.join(x)
 
     def __clear_response(self):
         # XXX naming
@@ -172,51 +299,86 @@ class PanWFapi:
         self.response_type = None
         self.xml_element_root = None
         self.attachment = None
-
-    def __set_response(self, response):
-        message_body = response.read()
-
-        content_type = self._message.get_content_type()
+        self._xml_root = None  # cached xml_root() serialization
+        self._sink = None
+
+    def __set_response(self, response=None, message_body=None):
+        # with a caller-supplied sink, copy an attachment straight
+        # from the response to the sink instead of reading it into
+        # memory
+        if (self._sink is not None and response is not None and
+                message_body is None and
+                self._content_type == 'application/octet-stream'):
+            return self.__set_stream_response(response, None)
+
+        if message_body is None:
+            message_body = response.read()
+
+        # urllib3 and aiohttp decode compressed bodies themselves
+        if (not self._transport_decodes and message_body and
+                self._content_encoding in ('gzip', 'deflate')):
+            try:
+                message_body = _decode_content(message_body,
+                                               self._content_encoding)
+            except (OSError, zlib.error) as e:
+                self._msg = 'content-encoding %s: %s' % (
+                    self._content_encoding, e)
+                return False
+
+        content_type = self._content_type
         if not content_type:
             if self._msg is None:
                 self._msg = 'no content-type response header'
             return False
 
-        if content_type == 'application/octet-stream':
-            return self.__set_stream_response(response, message_body)
-
-        # XXX text/xml RFC 3023
-        elif (content_type == 'application/xml' or
-              content_type == 'text/xml'):
-            return self.__set_xml_response(message_body)
-
-        elif content_type == 'application/json':
-            return self.__set_json_response(message_body)
-
-        elif content_type == 'text/html':
-            return self.__set_html_response(message_body)
-
-        elif content_type == 'text/plain':
-            return self.__set_txt_response(message_body)
-
-        else:
+        handler = self._CONTENT_DISPATCH.get(content_type)
+        if handler is None:
             msg = 'no handler for content-type: %s' % content_type
             self._msg = msg
             return False
 
+        return handler(self, response, message_body)
+
+    def __content_filename(self):
+        # the RFC 5987 form takes precedence over a plain filename
+        m = _filename_ext_regex.search(self._content_disposition)
+        if m is not None:
+            value = m.group(2).strip()
+            try:
+                return unquote(value, encoding=m.group(1) or _encoding)
+            except LookupError:
+                # unknown charset
+                return unquote(value)
+        m = _filename_regex.search(self._content_disposition)
+        if m is None:
+            return None
+        return m.group(1) or m.group(2).strip()
+
     def __set_stream_response(self, response, message_body):
-        filename = self._message.get_filename()
+        filename = self.__content_filename()
         if not filename:
             self._msg = 'no content-disposition response header'
             return False
 
         attachment = {}
         attachment['filename'] = filename
-        attachment['content'] = message_body
+        if message_body is None:
+            size = 0
+            while True:
+                buf = response.read(1 << 20)
+                if not buf:
+                    break
+                self._sink.write(buf)
+                size += len(buf)
+            attachment['content'] = None
+            attachment['size'] = size
+        else:
+            attachment['content'] = message_body
+            attachment['size'] = len(message_body)
         self.attachment = attachment
         return True
 
-    def __set_xml_response(self, message_body):
+    def __set_xml_response(self, response, message_body):
         self._log(DEBUG2, '__set_xml_response: %s', repr(message_body))
         self.response_type = 'xml'
 
@@ -228,25 +390,26 @@ class PanWFapi:
 
         # ParseError: "XML or text declaration not at start of entity"
         # fix: remove leading blank lines if exist
-        _message_body = message_body
-        while (_message_body[0:1] == b'\r' or
-               _message_body[0:1] == b'\n'):
-            _message_body = _message_body[1:]
+        _message_body = message_body.lstrip(b'\r\n')
 
         if len(_message_body) == 0:
             return True
 
+        # XMLParser.feed() parses the bytes in place; fromstring()
+        # would make another copy
         try:
-            element = etree.fromstring(_message_body)
+            parser = etree.XMLParser()
+            parser.feed(_message_body)
+            element = parser.close()
         except etree.ParseError as msg:
-            self._msg = 'ElementTree.fromstring ParseError: %s' % msg
+            self._msg = 'ElementTree XMLParser ParseError: %s' % msg
             return False
 
         self.xml_element_root = element
 
         return True
 
-    def __set_json_response(self, message_body):
+    def __set_json_response(self, response, message_body):
         self._log(DEBUG2, '__set_json_response: %s', repr(message_body))
         self.response_type = 'json'
 
@@ -258,7 +421,7 @@ class PanWFapi:
 
         return True
 
-    def __set_html_response(self, message_body):
+    def __set_html_response(self, response, message_body):
         self._log(DEBUG2, '__set_html_response: %s', repr(message_body))
         self.response_type = 'html'
 
@@ -270,7 +433,7 @@ class PanWFapi:
 
         return True
 
-    def __set_txt_response(self, message_body):
+    def __set_txt_response(self, response, message_body):
         self._log(DEBUG2, '__set_txt_response: %s', repr(message_body))
         self.response_type = 'txt'
 
@@ -282,86 +445,166 @@ class PanWFapi:
 
         return True
 
-    # XXX store tostring() results?
+    # XXX text/xml RFC 3023
+    _CONTENT_DISPATCH = {
+        'application/octet-stream': __set_stream_response,
+        'application/xml': __set_xml_response,
+        'text/xml': __set_xml_response,
+        'application/json': __set_json_response,
+        'text/html': __set_html_response,
+        'text/plain': __set_txt_response,
+    }
+
     # XXX rework this
     def xml_root(self):
         if self.xml_element_root is None:
             return None
 
+        if self._xml_root is not None:
+            return self._xml_root
+
         s = etree.tostring(self.xml_element_root, encoding=_encoding)
 
         if not s:
             return None
 
         self._log(DEBUG3, 'xml_root: %s', type(s))
-        self._log(DEBUG3, 'xml_root.decode(): %s', type(s.decode(_encoding)))
-        return s.decode(_encoding)
+        self._xml_root = s.decode(_encoding)
+        return self._xml_root
 
-    def __api_request(self, request_uri, body, headers={}):
+    def _build_request(self, request_uri, body, headers):
         url = self.uri
         url += request_uri
 
-        # body must be type 'bytes'
+        if headers is None:
+            headers = dict(_DEFAULT_HEADERS)
+        else:
+            headers = {**_DEFAULT_HEADERS, **headers}
+
+        # single choke point for body normalization: internal callers
+        # pass bytes (multipart) or an iterable of bytes (streaming
+        # submit); encode stray str bodies once here
         if isinstance(body, str):
             body = body.encode()
 
-        request = Request(url, body, headers)
-
-        self._log(DEBUG1, 'URL: %s', url)
-        self._log(DEBUG1, 'method: %s', request.get_method())
-        self._log(DEBUG1, 'headers: %s', request.header_items())
-
-        # XXX leaks apikey
-#        self._log(DEBUG3, 'body: %s', repr(body))
-
-        kwargs = {
-            'url': request,
-        }
-
-        if self.ssl_context is not None:
-            kwargs['context'] = self.ssl_context
-
-        if self.timeout is not None:
-            kwargs['timeout'] = self.timeout
-
-        try:
-            response = self._urlopen(**kwargs)
-        except ssl.CertificateError as e:
-            self._msg = 'ssl.CertificateError: %s' % e
-            return False
-        except (URLError, IOError) as e:
-            self._log(DEBUG2, 'urlopen() exception: %s', sys.exc_info())
-            self._msg = str(e)
-            return False
-
-        self.http_code = response.getcode()
-        self.http_reason = response.reason
+        return url, body, headers
 
-        if self.http_reason == '':
+    def _parse_response(self, headers):
+        if not self.http_reason:
             if self.http_code in _wildfire_responses:
                 self.http_reason = _wildfire_responses[self.http_code]
             elif self.http_code in responses:
                 self.http_reason = responses[self.http_code]
 
-        try:
-            self._message = email.message_from_string(str(response.info()))
-        except (TypeError, email.errors.MessageError) as e:
-            raise PanWFapiError('email.message_from_string() %s' % e)
+        # avoid the email.message_from_string() RFC 5322 parser; we
+        # only need content-type and the content-disposition filename
+        m = _content_type_regex.match(headers.get('Content-Type', ''))
+        self._content_type = m.group(1).lower() if m else ''
+        self._content_disposition = headers.get('Content-Disposition', '')
+        self._content_encoding = headers.get('Content-Encoding', '').lower()
 
         self._log(DEBUG2, 'HTTP response code: %s', self.http_code)
         self._log(DEBUG2, 'HTTP response reason: %s', self.http_reason)
         self._log(DEBUG2, 'HTTP response headers:')
-        self._log(DEBUG2, '%s', self._message)
+        self._log(DEBUG2, '%s', headers)
 
         if not (200 <= self.http_code < 300):
             self._msg = 'HTTP Error %s: %s' % (self.http_code,
                                                self.http_reason)
+            return False
+
+        return True
+
+    # read-only endpoints accept GET; the query goes in the URL so no
+    # request body or urlencoded content-type header is needed
+    def __api_request_get(self, request_uri, query, headers=None):
+        if query:
+            request_uri += '?' + _urlencode(query)
+        return self.__api_request(request_uri=request_uri, body=None,
+                                  headers=headers)
+
+    async def __api_request_get_async(self, request_uri, query,
+                                      headers=None):
+        if query:
+            request_uri += '?' + _urlencode(query)
+        return await self.__api_request_async(request_uri=request_uri,
+                                              body=None, headers=headers)
+
+    def __api_request(self, request_uri, body, headers=None):
+        url, body, headers = self._build_request(request_uri, body, headers)
+
+        if self._http is not None:
+            response = self.__http_request_urllib3(url, body, headers)
+        else:
+            response = self.__http_request_urllib(url, body, headers)
+        if response is False:
+            return False
+
+        if not self._parse_response(response.headers):
             self.__set_response(response)
             return False
 
         return response
 
+    def _ensure_session(self):
+        if not _have_aiohttp:
+            raise PanWFapiError('aiohttp required for async methods')
+
+        if self._session is None:
+            connector_kwargs = {'limit': 32}
+            if self.ssl_context is not None:
+                connector_kwargs['ssl'] = self.ssl_context
+            kwargs = {
+                'connector': aiohttp.TCPConnector(**connector_kwargs),
+            }
+            if self.timeout is not None:
+                kwargs['timeout'] = aiohttp.ClientTimeout(total=self.timeout)
+            self._session = aiohttp.ClientSession(**kwargs)
+            self._log(DEBUG1, 'using aiohttp %s session',
+                      aiohttp.__version__)
+
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __api_request_async(self, request_uri, body, headers=None):
+        url, body, headers = self._build_request(request_uri, body, headers)
+
+        session = self._ensure_session()
+
+        method = 'GET' if body is None else 'POST'
+
+        self._log(DEBUG1, 'URL: %s', _redact_url(url))
+        self._log(DEBUG1, 'method: %s', method)
+        self._log(DEBUG1, 'headers: %s', headers)
+
+        try:
+            async with session.request(method, url, data=body,
+                                       headers=headers) as response:
+                self.http_code = response.status
+                self.http_reason = response.reason
+                self._transport_decodes = True
+                response_headers = response.headers
+                message_body = await response.read()
+        # asyncio.TimeoutError is only an OSError subclass on 3.11+
+        except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+            self._log(DEBUG2, 'aiohttp exception: %s', sys.exc_info())
+            # asyncio.TimeoutError stringifies to ''
+            self._msg = str(e) or 'timed out'
+            return False
+
+        if not self._parse_response(response_headers):
+            self.__set_response(message_body=message_body)
+            return False
+
+        return message_body
+
     def _read_file(self, path):
+        # returns an open binary file object; the multipart encoder
+        # streams it so the file is never fully buffered
         try:
             f = open(path, 'rb')
         except IOError as e:
@@ -369,21 +612,23 @@ class PanWFapi:
             self._msg = msg
             return None
 
-        buf = f.read()
-        f.close()
-
         self._log(DEBUG2, 'path: %s %d', type(path), len(path))
-        self._log(DEBUG2, 'path: %s size: %d', path, len(buf))
-        if logging.getLogger(__name__).getEffectiveLevel() == DEBUG3:
+        self._log(DEBUG2, 'path: %s size: %d', path, os.path.getsize(path))
+
+        if _logger.isEnabledFor(DEBUG3):
+            # hash incrementally; hashlib releases the GIL and uses
+            # the OpenSSL back end for chunked updates
             import hashlib
-            md5 = hashlib.md5()
-            md5.update(buf)
-            sha256 = hashlib.sha256()
-            sha256.update(buf)
+            md5 = hashlib.new('md5')
+            sha256 = hashlib.new('sha256')
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                md5.update(chunk)
+                sha256.update(chunk)
+            f.seek(0)
             self._log(DEBUG3, 'MD5: %s', md5.hexdigest())
             self._log(DEBUG3, 'SHA256: %s', sha256.hexdigest())
 
-        return buf
+        return f
 
     def report(self,
                hash=None,
@@ -404,19 +649,67 @@ class PanWFapi:
         if url is not None:
             query['url'] = url
 
-        response = self.__api_request(request_uri=request_uri,
-                                      body=urlencode(query))
+        response = self.__api_request_get(request_uri, query)
         if not response:
             raise PanWFapiError(self._msg)
 
         if not self.__set_response(response):
             raise PanWFapiError(self._msg)
 
+    async def report_async(self,
+                           hash=None,
+                           format=None,
+                           url=None):
+        self.__clear_response()
+
+        request_uri = '/publicapi/get/report'
+
+        query = {}
+        query['apikey'] = self.api_key
+        if self.agent is not None:
+            query['agent'] = self.agent
+        if hash is not None:
+            query['hash'] = hash
+        if format is not None:
+            query['format'] = format
+        if url is not None:
+            query['url'] = url
+
+        message_body = await self.__api_request_get_async(request_uri,
+                                                          query)
+        if message_body is False:
+            raise PanWFapiError(self._msg)
+
+        if not self.__set_response(message_body=message_body):
+            raise PanWFapiError(self._msg)
+
+        return self.response_body
+
     def verdict(self,
                 hash=None,
                 url=None):
         self.__clear_response()
 
+        # a verdict is idempotent for a given hash over short periods;
+        # with verdict_cache_ttl set, replay the cached response
+        # instead of performing a network round-trip
+        cache_key = (hash, url)
+        if self._verdict_cache_ttl:
+            hit = self._verdict_cache.get(cache_key)
+            if hit is not None:
+                if time.monotonic() - hit[0] < self._verdict_cache_ttl:
+                    self._log(DEBUG1, 'verdict cache hit: %s', hash)
+                    (_, self.http_code, self.http_reason,
+                     self._content_type, self._content_disposition,
+                     message_body) = hit
+                    # the cached body is stored decoded
+                    self._content_encoding = ''
+                    self._transport_decodes = True
+                    if not self.__set_response(message_body=message_body):
+                        raise PanWFapiError(self._msg)
+                    return
+                del self._verdict_cache[cache_key]
+
         request_uri = '/publicapi/get/verdict'
 
         query = {}
@@ -428,14 +721,64 @@ class PanWFapi:
         if url is not None:
             query['url'] = url
 
-        response = self.__api_request(request_uri=request_uri,
-                                      body=urlencode(query))
+        response = self.__api_request_get(request_uri, query)
         if not response:
             raise PanWFapiError(self._msg)
 
-        if not self.__set_response(response):
+        message_body = response.read()
+        if not self.__set_response(message_body=message_body):
+            raise PanWFapiError(self._msg)
+
+        if self._verdict_cache_ttl:
+            # cache the decoded body; an intervening request resets
+            # the content-encoding state the raw body would need
+            if (not self._transport_decodes and
+                    self._content_encoding in ('gzip', 'deflate')):
+                message_body = _decode_content(message_body,
+                                               self._content_encoding)
+            cache = self._verdict_cache
+            if len(cache) >= _VERDICT_CACHE_SIZE:
+                # insertion order is timestamp order, so expired
+                # entries are at the front; stop at the first live one
+                now = time.monotonic()
+                for key in list(cache):
+                    if now - cache[key][0] < self._verdict_cache_ttl:
+                        break
+                    del cache[key]
+                if len(cache) >= _VERDICT_CACHE_SIZE:
+                    # still full: evict the oldest entry
+                    del cache[next(iter(cache))]
+            cache[cache_key] = (
+                time.monotonic(), self.http_code, self.http_reason,
+                self._content_type, self._content_disposition,
+                message_body)
+
+    async def verdict_async(self,
+                            hash=None,
+                            url=None):
+        self.__clear_response()
+
+        request_uri = '/publicapi/get/verdict'
+
+        query = {}
+        query['apikey'] = self.api_key
+        if self.agent is not None:
+            query['agent'] = self.agent
+        if hash is not None:
+            query['hash'] = hash
+        if url is not None:
+            query['url'] = url
+
+        message_body = await self.__api_request_get_async(request_uri,
+                                                          query)
+        if message_body is False:
             raise PanWFapiError(self._msg)
 
+        if not self.__set_response(message_body=message_body):
+            raise PanWFapiError(self._msg)
+
+        return self.response_body
+
     def verdicts(self,
                  hashes=None):
         self.__clear_response()
@@ -443,7 +786,7 @@ class PanWFapi:
         request_uri = '/publicapi/get/verdicts'
 
         form = _MultiPartFormData()
-        form.add_field('apikey', self.api_key)
+        form.add_part(copy.copy(self._apikey_field))
         if self.agent is not None:
             form.add_field('agent', self.agent)
         if hashes is not None:
@@ -460,6 +803,33 @@ class PanWFapi:
         if not self.__set_response(response):
             raise PanWFapiError(self._msg)
 
+    async def verdicts_async(self,
+                             hashes=None):
+        self.__clear_response()
+
+        request_uri = '/publicapi/get/verdicts'
+
+        form = _MultiPartFormData()
+        form.add_part(copy.copy(self._apikey_field))
+        if self.agent is not None:
+            form.add_field('agent', self.agent)
+        if hashes is not None:
+            form.add_field('file', '\n'.join(hashes))
+
+        headers = form.http_headers()
+        body = form.http_body()
+
+        message_body = await self.__api_request_async(
+            request_uri=request_uri,
+            body=body, headers=headers)
+        if message_body is False:
+            raise PanWFapiError(self._msg)
+
+        if not self.__set_response(message_body=message_body):
+            raise PanWFapiError(self._msg)
+
+        return self.response_body
+
     def verdicts_changed(self,
                          date=None):
         self.__clear_response()
@@ -473,17 +843,41 @@ class PanWFapi:
         if date is not None:
             query['date'] = date
 
-        response = self.__api_request(request_uri=request_uri,
-                                      body=urlencode(query))
+        response = self.__api_request_get(request_uri, query)
         if not response:
             raise PanWFapiError(self._msg)
 
         if not self.__set_response(response):
             raise PanWFapiError(self._msg)
 
+    async def verdicts_changed_async(self,
+                                     date=None):
+        self.__clear_response()
+
+        request_uri = '/publicapi/get/verdicts/changed'
+
+        query = {}
+        query['apikey'] = self.api_key
+        if self.agent is not None:
+            query['agent'] = self.agent
+        if date is not None:
+            query['date'] = date
+
+        message_body = await self.__api_request_get_async(request_uri,
+                                                          query)
+        if message_body is False:
+            raise PanWFapiError(self._msg)
+
+        if not self.__set_response(message_body=message_body):
+            raise PanWFapiError(self._msg)
+
+        return self.response_body
+
     def sample(self,
-               hash=None):
+               hash=None,
+               sink=None):
         self.__clear_response()
+        self._sink = sink
 
         request_uri = '/publicapi/get/sample'
 
@@ -494,18 +888,43 @@ class PanWFapi:
         if hash is not None:
             query['hash'] = hash
 
-        response = self.__api_request(request_uri=request_uri,
-                                      body=urlencode(query))
+        response = self.__api_request_get(request_uri, query,
+                                          headers=_ATTACHMENT_HEADERS)
         if not response:
             raise PanWFapiError(self._msg)
 
         if not self.__set_response(response):
             raise PanWFapiError(self._msg)
 
+    async def sample_async(self,
+                           hash=None):
+        self.__clear_response()
+
+        request_uri = '/publicapi/get/sample'
+
+        query = {}
+        query['apikey'] = self.api_key
+        if self.agent is not None:
+            query['agent'] = self.agent
+        if hash is not None:
+            query['hash'] = hash
+
+        message_body = await self.__api_request_get_async(
+            request_uri, query, headers=_ATTACHMENT_HEADERS)
+        if message_body is False:
+            raise PanWFapiError(self._msg)
+
+        if not self.__set_response(message_body=message_body):
+            raise PanWFapiError(self._msg)
+
+        return self.attachment
+
     def pcap(self,
              hash=None,
-             platform=None):
+             platform=None,
+             sink=None):
         self.__clear_response()
+        self._sink = sink
 
         request_uri = '/publicapi/get/pcap'
 
@@ -518,14 +937,40 @@ class PanWFapi:
         if platform is not None:
             query['platform'] = platform
 
-        response = self.__api_request(request_uri=request_uri,
-                                      body=urlencode(query))
+        response = self.__api_request_get(request_uri, query,
+                                          headers=_ATTACHMENT_HEADERS)
         if not response:
             raise PanWFapiError(self._msg)
 
         if not self.__set_response(response):
             raise PanWFapiError(self._msg)
 
+    async def pcap_async(self,
+                         hash=None,
+                         platform=None):
+        self.__clear_response()
+
+        request_uri = '/publicapi/get/pcap'
+
+        query = {}
+        query['apikey'] = self.api_key
+        if self.agent is not None:
+            query['agent'] = self.agent
+        if hash is not None:
+            query['hash'] = hash
+        if platform is not None:
+            query['platform'] = platform
+
+        message_body = await self.__api_request_get_async(
+            request_uri, query, headers=_ATTACHMENT_HEADERS)
+        if message_body is False:
+            raise PanWFapiError(self._msg)
+
+        if not self.__set_response(message_body=message_body):
+            raise PanWFapiError(self._msg)
+
+        return self.attachment
+
     def testfile(self, file_type=None):
         self.__clear_response()
 
@@ -534,20 +979,14 @@ class PanWFapi:
 
         query = {}
 
-        response = self.__api_request(request_uri=request_uri,
-                                      body=urlencode(query))
+        response = self.__api_request_get(request_uri, query)
         if not response:
             raise PanWFapiError(self._msg)
 
         if not self.__set_response(response):
             raise PanWFapiError(self._msg)
 
-    def submit(self,
-               file=None,
-               url=None,
-               links=None):
-        self.__clear_response()
-
+    def __submit_request(self, file, url, links):
         if (sum(bool(x) for x in [file, url, links]) != 1):
             raise PanWFapiError('must submit one of file, url or links')
 
@@ -561,16 +1000,16 @@ class PanWFapi:
             request_uri = '/publicapi/submit/links'
 
         form = _MultiPartFormData()
-        form.add_field('apikey', self.api_key)
+        form.add_part(copy.copy(self._apikey_field))
         if self.agent is not None:
             form.add_field('agent', self.agent)
 
         if file is not None:
-            buf = self._read_file(file)
-            if buf is None:
+            f = self._read_file(file)
+            if f is None:
                 raise PanWFapiError(self._msg)
             filename = os.path.basename(file)
-            form.add_file(filename, buf)
+            form.add_file(filename, f)
 
         if url is not None:
             form.add_field('url', url)
@@ -588,17 +1027,56 @@ class PanWFapi:
                     form.add_file(filename='pan',
                                   body=magic + '\n' + '\n'.join(links))
 
+        return request_uri, form
+
+    def submit(self,
+               file=None,
+               url=None,
+               links=None):
+        self.__clear_response()
+
+        request_uri, form = self.__submit_request(file, url, links)
+
+        # stream the multipart body so large samples are not
+        # materialized in memory
         headers = form.http_headers()
-        body = form.http_body()
+        headers['Content-Length'] = str(form.content_length())
+        body = form.iter_chunks()
 
-        response = self.__api_request(request_uri=request_uri,
-                                      body=body, headers=headers)
+        try:
+            response = self.__api_request(request_uri=request_uri,
+                                          body=body, headers=headers)
+        finally:
+            form.close()
         if not response:
             raise PanWFapiError(self._msg)
 
         if not self.__set_response(response):
             raise PanWFapiError(self._msg)
 
+    async def submit_async(self,
+                           file=None,
+                           url=None,
+                           links=None):
+        self.__clear_response()
+
+        request_uri, form = self.__submit_request(file, url, links)
+
+        headers = form.http_headers()
+        body = form.http_body()
+        form.close()
+
+        message_body = await self.__api_request_async(
+            request_uri=request_uri,
+            body=body, headers=headers)
+        if message_body is False:
+            raise PanWFapiError(self._msg)
+
+        if not self.__set_response(message_body=message_body):
+            raise PanWFapiError(self._msg)
+
+        return self.response_body
+
     def change_request(self,
                        hash=None,
                        verdict=None,
@@ -609,7 +1087,7 @@ class PanWFapi:
         request_uri = '/publicapi/submit/change-request'
 
         form = _MultiPartFormData()
-        form.add_field('apikey', self.api_key)
+        form.add_part(copy.copy(self._apikey_field))
         if self.agent is not None:
             form.add_field('agent', self.agent)
         if hash is not None:
@@ -632,6 +1110,42 @@ class PanWFapi:
         if not self.__set_response(response):
             raise PanWFapiError(self._msg)
 
+    async def change_request_async(self,
+                                   hash=None,
+                                   verdict=None,
+                                   email=None,
+                                   comment=None):
+        self.__clear_response()
+
+        request_uri = '/publicapi/submit/change-request'
+
+        form = _MultiPartFormData()
+        form.add_part(copy.copy(self._apikey_field))
+        if self.agent is not None:
+            form.add_field('agent', self.agent)
+        if hash is not None:
+            form.add_field('hash', hash)
+        if verdict is not None:
+            form.add_field('verdict', verdict)
+        if email is not None:
+            form.add_field('email', email)
+        if comment is not None:
+            form.add_field('comment', comment)
+
+        headers = form.http_headers()
+        body = form.http_body()
+
+        message_body = await self.__api_request_async(
+            request_uri=request_uri,
+            body=body, headers=headers)
+        if message_body is False:
+            raise PanWFapiError(self._msg)
+
+        if not self.__set_response(message_body=message_body):
+            raise PanWFapiError(self._msg)
+
+        return self.response_body
+
     def web_artifacts(self, *,
                       url=None,
                       types=None):
@@ -648,14 +1162,81 @@ class PanWFapi:
         if types is not None:
             query['types'] = types
 
-        response = self.__api_request(request_uri=request_uri,
-                                      body=urlencode(query))
+        response = self.__api_request_get(request_uri, query)
         if not response:
             raise PanWFapiError(self._msg)
 
         if not self.__set_response(response):
             raise PanWFapiError(self._msg)
 
+    def __http_request_urllib3(self, url, body, headers):
+        method = 'GET' if body is None else 'POST'
+        if body is not None:
+            x = set(k.lower() for k in headers)
+            if 'content-type' not in x:
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        self._log(DEBUG1, 'URL: %s', _redact_url(url))
+        self._log(DEBUG1, 'method: %s', method)
+        self._log(DEBUG1, 'headers: %s', headers)
+
+        # urllib3 does not raise on non-2XX HTTP status so error
+        # response bodies are preserved
+        try:
+            response = self._http.urlopen(method, url,
+                                          body=body,
+                                          headers=headers,
+                                          timeout=self.timeout,
+                                          preload_content=False)
+        except (urllib3.exceptions.HTTPError, IOError) as e:
+            self._log(DEBUG2, 'urlopen() exception: %s', sys.exc_info())
+            self._msg = str(e)
+            return False
+
+        self.http_code = response.status
+        self.http_reason = response.reason
+        self._transport_decodes = True
+
+        return response
+
+    def __http_request_urllib(self, url, body, headers):
+        # urllib does not decompress; __set_response decodes the body
+        # per the content-encoding response header
+        request = Request(url, body, headers)
+
+        self._log(DEBUG1, 'URL: %s', _redact_url(url))
+        self._log(DEBUG1, 'method: %s', request.get_method())
+        self._log(DEBUG1, 'headers: %s', request.header_items())
+
+        # XXX leaks apikey
+#        self._log(DEBUG3, 'body: %s', repr(body))
+
+        kwargs = {
+            'url': request,
+        }
+
+        if self.ssl_context is not None:
+            kwargs['context'] = self.ssl_context
+
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+
+        try:
+            response = self._urlopen(**kwargs)
+        except ssl.CertificateError as e:
+            self._msg = 'ssl.CertificateError: %s' % e
+            return False
+        except (URLError, IOError) as e:
+            self._log(DEBUG2, 'urlopen() exception: %s', sys.exc_info())
+            self._msg = str(e)
+            return False
+
+        self.http_code = response.getcode()
+        self.http_reason = response.reason
+        self._transport_decodes = False
+
+        return response
+
     # allow non-2XX error codes
     # see http://bugs.python.org/issue18543 for why we can't just
     # install a new HTTPErrorProcessor()
@@ -679,13 +1260,6 @@ class PanWFapi:
 
         return opener.open(url, data, timeout)
 
-    def _certifi_ssl_context(self):
-        where = certifi.where()
-        self._log(DEBUG1, 'certifi %s: %s', certifi.__version__, where)
-        return ssl.create_default_context(
-            purpose=ssl.Purpose.SERVER_AUTH,
-            cafile=where)
-
 
 #
 # XXX USE OF cloud_ssl_context() IS DEPRECATED!
@@ -751,7 +1325,7 @@ ReYNnyicsbkqWletNw+vHX/bvZ8=
 
 class _MultiPartFormData:
     def __init__(self):
-        self._log = logging.getLogger(__name__).log
+        self._log = _logger.log
         self.parts = []
         self.boundary = self._boundary()
 
@@ -760,6 +1334,9 @@ class _MultiPartFormData:
                              body=value)
         self.parts.append(part)
 
+    def add_part(self, part):
+        self.parts.append(part)
+
     def add_file(self, filename=None, body=None):
         part = _FormDataPart(name='file')
         if filename is not None:
@@ -769,28 +1346,16 @@ class _MultiPartFormData:
             part.add_body(body)
         self.parts.append(part)
 
-    def _boundary(self):
-        rand_bytes = 48
-        prefix_char = b'_'
-        prefix_len = 16
+    def close(self):
+        # close any file-like part bodies
+        for part in self.parts:
+            if hasattr(part.body, 'close'):
+                part.body.close()
 
-        import base64
-        try:
-            import os
-            seq = os.urandom(rand_bytes)
-            self._log(DEBUG1, '_MultiPartFormData._boundary: %s',
-                      'using os.urandom')
-        except NotImplementedError:
-            import random
-            self._log(DEBUG1, '_MultiPartFormData._boundary: %s',
-                      'using random')
-            seq = bytearray()
-            [seq.append(random.randrange(256)) for i in range(rand_bytes)]
-
-        prefix = prefix_char * prefix_len
-        boundary = prefix + base64.b64encode(seq)
-
-        return boundary
+    def _boundary(self):
+        # the boundary only needs to be collision-resistant within
+        # the body; token_hex() returns ready-to-use ASCII
+        return b'_' * 16 + secrets.token_hex(16).encode('ascii')
 
     def http_headers(self):
         # headers cannot be bytes
@@ -803,48 +1368,92 @@ class _MultiPartFormData:
         return headers
 
     def http_body(self):
-        bio = BytesIO()
-
+        # b''.join() allocates the final body exactly once
         boundary = b'--' + self.boundary
+        chunks = []
+        append = chunks.append
+        for part in self.parts:
+            append(boundary)
+            append(b'\r\n')
+            append(part.serialize())
+            append(b'\r\n')
+        append(boundary)
+        append(b'--')
+
+        return b''.join(chunks)
+
+    def content_length(self):
+        boundary_len = len(self.boundary) + 2  # b'--' prefix
+
+        total = 0
         for part in self.parts:
-            bio.write(boundary)
-            bio.write(b'\r\n')
-            bio.write(part.serialize())
-            bio.write(b'\r\n')
-        bio.write(boundary)
-        bio.write(b'--')
+            total += boundary_len + 2  # boundary CRLF
+            total += len(part.header_block())
+            total += part.body_size() + 2  # body CRLF
+        total += boundary_len + 2  # closing boundary b'--'
 
-        return bio.getvalue()
+        return total
+
+    def iter_chunks(self, chunk_size=65536):
+        boundary = b'--' + self.boundary
+        for part in self.parts:
+            yield boundary + b'\r\n'
+            yield part.header_block()
+            body = part.body
+            if body is not None:
+                if hasattr(body, 'read'):
+                    while True:
+                        buf = body.read(chunk_size)
+                        if not buf:
+                            break
+                        yield buf
+                else:
+                    yield body
+            yield b'\r\n'
+        yield boundary + b'--'
 
 
 class _FormDataPart:
     def __init__(self, name=None, body=None):
-        self._log = logging.getLogger(__name__).log
+        self._log = _logger.log
         self.headers = []
+        self._header_block = None
         self.add_header(b'Content-Disposition: form-data')
         self.append_header('name', name)
         self.body = None
         if body is not None:
             self.add_body(body)
 
+    def __copy__(self):
+        # copy the headers list so append_header() on a copy cannot
+        # rewrite a prototype part (e.g. the cached apikey part)
+        x = self.__class__.__new__(self.__class__)
+        x.__dict__.update(self.__dict__)
+        x.headers = list(self.headers)
+        return x
+
+    # these run per multipart field; don't build log argument tuples
+    # unless DEBUG1 is enabled
     def add_header(self, header):
         self.headers.append(header)
-        self._log(DEBUG1, '_FormDataPart.add_header: %s', self.headers[-1])
+        self._header_block = None
+        if _logger.isEnabledFor(DEBUG1):
+            self._log(DEBUG1, '_FormDataPart.add_header: %s',
+                      self.headers[-1])
 
     def append_header(self, name, value):
         self.headers[-1] += b'; ' + self._encode_field(name, value)
-        self._log(DEBUG1, '_FormDataPart.append_header: %s', self.headers[-1])
+        self._header_block = None
+        if _logger.isEnabledFor(DEBUG1):
+            self._log(DEBUG1, '_FormDataPart.append_header: %s',
+                      self.headers[-1])
 
     def _encode_field(self, name, value):
-        self._log(DEBUG1, '_FormDataPart._encode_field: %s %s',
-                  type(name), type(value))
         if not _rfc2231_encode:
-            s = '%s="%s"' % (name, value)
-            self._log(DEBUG1, '_FormDataPart._encode_field: %s %s',
-                      type(s), s)
-            s = s.encode('utf-8')
-            self._log(DEBUG1, '_FormDataPart._encode_field: %s %s',
-                      type(s), s)
+            s = _encode_field_utf8(name, value)
+            if _logger.isEnabledFor(DEBUG1):
+                self._log(DEBUG1, '_FormDataPart._encode_field: %s %s',
+                          type(s), s)
             return s
 
         if not [ch for ch in '\r\n\\' if ch in value]:
@@ -859,20 +1468,38 @@ class _FormDataPart:
         return ('%s*=%s' % (name, value)).encode('ascii')
 
     def add_body(self, body):
+        # body can be bytes, str or a binary file-like object; file
+        # objects are read in chunks at serialization time
         if isinstance(body, str):
             body = body.encode('latin-1')
         self.body = body
-        self._log(DEBUG1, '_FormDataPart.add_body: %s %d',
-                  type(self.body), len(self.body))
+        if _logger.isEnabledFor(DEBUG1):
+            self._log(DEBUG1, '_FormDataPart.add_body: %s %d',
+                      type(self.body), self.body_size())
+
+    def body_size(self):
+        if self.body is None:
+            return 0
+        if hasattr(self.body, 'read'):
+            pos = self.body.tell()
+            end = self.body.seek(0, 2)
+            self.body.seek(pos)
+            return end - pos
+        return len(self.body)
+
+    def header_block(self):
+        if self._header_block is None:
+            self._header_block = b'\r\n'.join(self.headers) + b'\r\n\r\n'
+        return self._header_block
 
     def serialize(self):
-        bio = BytesIO()
-        bio.write(b'\r\n'.join(self.headers))
-        bio.write(b'\r\n\r\n')
-        if self.body is not None:
-            bio.write(self.body)
+        body = self.body
+        if body is None:
+            body = b''
+        elif hasattr(body, 'read'):
+            body = body.read()
 
-        return bio.getvalue()
+        return self.header_block() + body
 
 
 if __name__ == '__main__':